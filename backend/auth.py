@@ -1,55 +1,178 @@
 import os
+import base64
+import functools
+import hashlib
+import hmac
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional, Tuple
 
-import jwt
+import anyio
+import anyio.to_thread
 import bcrypt
+import orjson
+from cachetools import LRUCache, TTLCache
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session, selectinload
 
 from database import get_db
-from models import User
+from models import User, utc_now_sql
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "odyssvault-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7
+BCRYPT_COST = int(os.environ.get("BCRYPT_COST", "13"))
+BCRYPT_THREADS = os.cpu_count() or 1
+BCRYPT_HASH_LENGTH = 60
+BCRYPT_PREFIXES = (b"$2a$", b"$2b$", b"$2y$")
+UNUSABLE_PASSWORD = "!"
+GUEST_MAX_AGE_DAYS = 7
+GUEST_REAP_BATCH_SIZE = 100
+
+_SECRET_KEY_BYTES = SECRET_KEY.encode('utf-8')
+_TOKEN_HEADER = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b"=")
+
+PASSWORD_CACHE_SIZE = 4096
+PASSWORD_CACHE_TTL_SECONDS = 5 * 60
+TOKEN_CACHE_SIZE = 8192
 
 security = HTTPBearer(auto_error=False)
 
+_bcrypt_limiter: Optional[anyio.CapacityLimiter] = None
+
+# Only successful verifications are remembered, keyed by a digest of the
+# (password, hash) pair so raw passwords never sit in the cache. A new hash
+# (e.g. after a password change) produces a new key, so stale entries simply
+# stop matching and age out with the TTL.
+_password_cache = TTLCache(maxsize=PASSWORD_CACHE_SIZE, ttl=PASSWORD_CACHE_TTL_SECONDS)
+_password_cache_lock = threading.Lock()
+
+_token_cache = LRUCache(maxsize=TOKEN_CACHE_SIZE)
+_token_cache_lock = threading.Lock()
+
+
+def _password_cache_key(password_bytes: bytes, hashed_bytes: bytes) -> bytes:
+    return hashlib.blake2b(password_bytes, key=hashed_bytes[:64], digest_size=32).digest()
+
+
+def _is_bcrypt_hash(hashed_bytes: bytes) -> bool:
+    prefix = hashed_bytes[:4]
+    matched = False
+    for candidate in BCRYPT_PREFIXES:
+        matched |= hmac.compare_digest(prefix, candidate)
+    return matched and len(hashed_bytes) == BCRYPT_HASH_LENGTH
+
+
+@functools.lru_cache(maxsize=None)
+def _dummy_hash() -> bytes:
+    return bcrypt.hashpw(b"", bcrypt.gensalt(rounds=BCRYPT_COST))
+
+
+def _reject_with_bcrypt_cost(password_bytes: bytes) -> bool:
+    bcrypt.checkpw(password_bytes[:72], _dummy_hash())
+    return False
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     try:
         password_bytes = plain_password.encode('utf-8')
         hashed_bytes = hashed_password.encode('utf-8')
-        return bcrypt.checkpw(password_bytes, hashed_bytes)
+        if not _is_bcrypt_hash(hashed_bytes):
+            return _reject_with_bcrypt_cost(password_bytes)
+
+        cache_key = _password_cache_key(password_bytes, hashed_bytes)
+        with _password_cache_lock:
+            if _password_cache.get(cache_key):
+                return True
+
+        if not bcrypt.checkpw(password_bytes, hashed_bytes):
+            return False
+
+        with _password_cache_lock:
+            _password_cache[cache_key] = True
+        return True
     except Exception:
         return False
 
 
 def get_password_hash(password: str) -> str:
     password_bytes = password.encode('utf-8')[:72]
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=BCRYPT_COST)
     hashed = bcrypt.hashpw(password_bytes, salt)
     return hashed.decode('utf-8')
 
 
+def _b64url_encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64url_decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+def _sign(signing_input: bytes) -> bytes:
+    return _b64url_encode(hmac.new(_SECRET_KEY_BYTES, signing_input, hashlib.sha256).digest())
+
+
+async def run_bcrypt(func, *args):
+    global _bcrypt_limiter
+    if _bcrypt_limiter is None:
+        _bcrypt_limiter = anyio.CapacityLimiter(BCRYPT_THREADS)
+    return await anyio.to_thread.run_sync(func, *args, limiter=_bcrypt_limiter)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    if expires_delta is not None:
+        to_encode["exp"] = int(time.time() + expires_delta.total_seconds())
+    else:
+        to_encode["exp"] = int(time.time()) + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    signing_input = _TOKEN_HEADER + b"." + _b64url_encode(orjson.dumps(to_encode))
+    return (signing_input + b"." + _sign(signing_input)).decode('ascii')
 
 
-def decode_token(token: str) -> Optional[dict]:
+def _verify_token(token: str) -> Optional[dict]:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except jwt.ExpiredSignatureError:
+        header_b64, payload_b64, signature = token.encode('ascii').split(b".")
+        header = orjson.loads(_b64url_decode(header_b64))
+        if not isinstance(header, dict) or header.get("alg") != ALGORITHM:
+            return None
+        if not hmac.compare_digest(signature, _sign(header_b64 + b"." + payload_b64)):
+            return None
+        payload = orjson.loads(_b64url_decode(payload_b64))
+    except ValueError:
+        return None
+
+    if not isinstance(payload, dict):
+        return None
+    exp = payload.get("exp")
+    if exp is not None and (not isinstance(exp, (int, float)) or exp <= time.time()):
         return None
-    except jwt.InvalidTokenError:
+    return payload
+
+
+def decode_token(token: str) -> Optional[dict]:
+    with _token_cache_lock:
+        payload = _token_cache.get(token)
+
+    if payload is None:
+        payload = _verify_token(token)
+        if payload is None:
+            return None
+        with _token_cache_lock:
+            _token_cache[token] = payload
+        return dict(payload)
+
+    exp = payload.get("exp")
+    if exp is not None and exp <= time.time():
+        with _token_cache_lock:
+            _token_cache.pop(token, None)
         return None
+    return dict(payload)
 
 
 def get_user_by_email(db: Session, email: str) -> Optional[User]:
@@ -60,11 +183,18 @@ def get_user_by_username(db: Session, username: str) -> Optional[User]:
     return db.query(User).filter(User.username == username).first()
 
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
+def _load_login_user(db: Session, email: str) -> Tuple[Optional[User], Optional[str]]:
     user = get_user_by_email(db, email)
-    if not user:
-        return None
-    if not verify_password(password, user.hashed_password):
+    hashed_password = user.hashed_password if user else None
+    # End the read so the pooled connection is not held while bcrypt runs.
+    db.rollback()
+    return user, hashed_password
+
+
+async def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
+    user, hashed_password = await run_in_threadpool(_load_login_user, db, email)
+    password_ok = await run_bcrypt(verify_password, password, hashed_password or UNUSABLE_PASSWORD)
+    if not user or not password_ok:
         return None
     return user
 
@@ -122,11 +252,38 @@ def create_guest_user(db: Session) -> User:
     guest = User(
         email=f"guest_{guest_id}@odyssvault.local",
         username=f"guest_{guest_id}",
-        hashed_password=get_password_hash(f"guest_{guest_id}"),
-        is_guest=True
+        hashed_password=UNUSABLE_PASSWORD,
+        is_guest=True,
+        last_login=utc_now_sql()
     )
     db.add(guest)
     db.commit()
     db.refresh(guest)
 
     return guest
+
+
+def reap_guest_users(db: Session, max_age: timedelta = timedelta(days=GUEST_MAX_AGE_DAYS)) -> List[int]:
+    cutoff = datetime.utcnow() - max_age
+    vault_ids = []
+
+    while True:
+        guests = db.query(User).options(selectinload(User.vaults)).filter(
+            User.is_guest == True,
+            or_(
+                User.last_login < cutoff,
+                and_(User.last_login.is_(None), User.created_at < cutoff)
+            )
+        ).order_by(User.id).limit(GUEST_REAP_BATCH_SIZE).all()
+        if not guests:
+            break
+
+        vault_ids.extend(vault.id for guest in guests for vault in guest.vaults)
+        for guest in guests:
+            db.delete(guest)
+        db.commit()
+
+        if len(guests) < GUEST_REAP_BATCH_SIZE:
+            break
+
+    return vault_ids
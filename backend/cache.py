@@ -0,0 +1,110 @@
+import os
+import logging
+import multiprocessing
+import threading
+from typing import Optional
+
+from cachetools import TTLCache
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+REDIS_URL = os.environ.get("REDIS_URL")
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "")
+RESPONSE_CACHE_TTL_SECONDS = 300
+LOCAL_CACHE_SIZE = 1024
+REDIS_TIMEOUT_SECONDS = 0.25
+
+logger = logging.getLogger(__name__)
+
+
+class CacheManager:
+    def __init__(self, redis_url: Optional[str] = None, ttl: int = RESPONSE_CACHE_TTL_SECONDS, local: bool = False):
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(
+            redis_url,
+            socket_timeout=REDIS_TIMEOUT_SECONDS,
+            socket_connect_timeout=REDIS_TIMEOUT_SECONDS
+        ) if redis_url and redis else None
+        if redis_url and redis is None:
+            logger.warning("REDIS_URL is set but redis is not installed, response caching disabled")
+
+        # An in-process cache is only safe when this is the only process serving
+        # requests; uvicorn's --workers and --reload both run the app in spawned
+        # children, so those never get one even when it was asked for.
+        spawned = multiprocessing.parent_process() is not None
+        self.enabled = self._redis is not None or (local and not spawned)
+        if local and spawned and self._redis is None:
+            logger.warning("RESPONSE_CACHE=local ignored in a worker process, set REDIS_URL for a shared cache")
+        self._local = TTLCache(maxsize=LOCAL_CACHE_SIZE, ttl=ttl)
+        self._generations = {}
+        self._pending_bumps = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        if self._redis is not None:
+            try:
+                return self._redis.get(key)
+            except redis.RedisError as exc:
+                logger.warning("Redis GET %s failed: %s", key, exc)
+                return None
+        with self._lock:
+            return self._local.get(key)
+
+    def set(self, key: str, value: bytes) -> None:
+        if self._redis is not None:
+            try:
+                self._redis.setex(key, self.ttl, value)
+            except redis.RedisError as exc:
+                logger.warning("Redis SETEX %s failed: %s", key, exc)
+            return
+        with self._lock:
+            self._local[key] = value
+
+    def get_generation(self, key: str) -> Optional[int]:
+        if not self.enabled:
+            return None
+        if self._redis is not None:
+            # A generation whose bump is still pending may have stale entries
+            # under its current value, so it is not cached until the bump lands.
+            if self._pending_bumps and not self._replay_pending_bumps():
+                with self._lock:
+                    if key in self._pending_bumps:
+                        return None
+            try:
+                value = self._redis.get(key)
+            except redis.RedisError as exc:
+                logger.warning("Redis GET %s failed: %s", key, exc)
+                return None
+            return int(value) if value else 0
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def bump_generation(self, key: str) -> None:
+        if self._redis is not None:
+            try:
+                self._redis.incr(key)
+            except redis.RedisError as exc:
+                logger.warning("Redis INCR %s failed, will retry: %s", key, exc)
+                with self._lock:
+                    self._pending_bumps.add(key)
+            return
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def _replay_pending_bumps(self) -> bool:
+        with self._lock:
+            pending = list(self._pending_bumps)
+        for key in pending:
+            try:
+                self._redis.incr(key)
+            except redis.RedisError as exc:
+                logger.warning("Redis INCR %s retry failed: %s", key, exc)
+                return False
+            with self._lock:
+                self._pending_bumps.discard(key)
+        return True
+
+response_cache = CacheManager(REDIS_URL, local=RESPONSE_CACHE == "local")
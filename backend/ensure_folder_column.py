@@ -1,11 +1,35 @@
-from sqlalchemy import text
-from database import engine
-
-with engine.connect() as conn:
-    cols = conn.execute(text("PRAGMA table_info(notes)")).fetchall()
-    names = [c[1] for c in cols]
-    if "folder_id" in names:
-        print("folder_id column already present")
-    else:
-        conn.execute(text("ALTER TABLE notes ADD COLUMN folder_id INTEGER"))
-        print("Added folder_id column to notes")
\ No newline at end of file
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from database import engine
+
+
+def _add_column_if_missing(bind: Engine, table: str, column: str, ddl: str) -> bool:
+    names = [c["name"] for c in inspect(bind).get_columns(table)]
+    if column in names:
+        return False
+    with bind.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def ensure_folder_column(bind: Engine) -> bool:
+    return _add_column_if_missing(bind, "notes", "folder_id", "INTEGER")
+
+
+def ensure_version_compression_columns(bind: Engine) -> bool:
+    added_blob = _add_column_if_missing(bind, "note_versions", "content_zstd", "BLOB")
+    added_flag = _add_column_if_missing(bind, "note_versions", "is_compressed", "BOOLEAN NOT NULL DEFAULT 0")
+    return added_blob or added_flag
+
+
+if __name__ == "__main__":
+    if ensure_folder_column(engine):
+        print("Added folder_id column to notes")
+    else:
+        print("folder_id column already present")
+    if ensure_version_compression_columns(engine):
+        print("Added compression columns to note_versions")
+    else:
+        print("note_versions compression columns already present")
+    engine.dispose()
@@ -1,15 +1,25 @@
 import re
-from datetime import datetime
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from typing import List, Optional
 
-from fastapi import FastAPI, HTTPException, Depends, status, Query
+import orjson
+from fastapi import FastAPI, HTTPException, Depends, status, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-
-from database import engine, get_db, Base
-from models import Note, Folder, User, Vault, NoteVersion, note_links
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload
+
+from cache import response_cache
+from database import (
+    engine, get_db, Base, SessionLocal, ensure_indexes,
+    acquire_file_lock, SCHEMA_LOCK_PATH, REAPER_LOCK_PATH
+)
+from ensure_folder_column import ensure_folder_column, ensure_version_compression_columns
+from models import Note, Folder, User, Vault, NoteVersion, note_links, utc_now_sql
 from schemas import (
-    NoteCreate, NoteUpdate, NoteResponse,
+    NoteCreate, NoteUpdate, NoteResponse, NoteLinkInfo,
     FolderCreate, FolderUpdate, FolderResponse,
     GraphData, GraphNode, GraphEdge,
     UserCreate, UserLogin, UserResponse, TokenResponse,
@@ -19,15 +29,64 @@ from schemas import (
 from auth import (
     get_password_hash, authenticate_user, create_access_token,
     get_current_user, get_current_user_required, create_guest_user,
-    get_user_by_email, get_user_by_username
+    get_user_by_email, get_user_by_username, reap_guest_users, run_bcrypt
 )
 
-Base.metadata.create_all(bind=engine)
+GUEST_REAP_INTERVAL_SECONDS = 60 * 60
+
+logger = logging.getLogger(__name__)
+
+_LINK_RE = re.compile(r'\[\[([^\]]+)\]\]')
+
+
+def init_db():
+    schema_lock = acquire_file_lock(SCHEMA_LOCK_PATH)
+    try:
+        Base.metadata.create_all(bind=engine)
+        ensure_folder_column(engine)
+        ensure_version_compression_columns(engine)
+        ensure_indexes(engine)
+    finally:
+        schema_lock.close()
+
+
+init_db()
+
+
+def reap_guests():
+    db = SessionLocal()
+    try:
+        vault_ids = reap_guest_users(db)
+    finally:
+        db.close()
+    for vault_id in vault_ids:
+        invalidate_vault_cache(vault_id)
+
+
+async def reap_guests_periodically():
+    while True:
+        try:
+            await run_in_threadpool(reap_guests)
+        except Exception:
+            logger.exception("Guest user cleanup failed")
+        await asyncio.sleep(GUEST_REAP_INTERVAL_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    reaper_lock = acquire_file_lock(REAPER_LOCK_PATH, blocking=False)
+    reaper = asyncio.create_task(reap_guests_periodically()) if reaper_lock else None
+    yield
+    if reaper:
+        reaper.cancel()
+        reaper_lock.close()
+
 
 app = FastAPI(
     title="Odyss Notes API",
     description="REST API for markdown notes with .od extension, folders, and linking.",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -40,28 +99,77 @@ app.add_middleware(
 
 
 def parse_links(content: str) -> List[str]:
-    pattern = r'\[\[([^\]]+)\]\]'
-    return re.findall(pattern, content)
+    return _LINK_RE.findall(content)
 
 
 def update_note_links(db: Session, note: Note):
-    note.links_to = []
-    link_titles = parse_links(note.content)
+    titles = set(parse_links(note.content))
+    target_ids = set()
+    if titles:
+        rows = db.query(Note.id, Note.title).filter(
+            Note.title.in_(titles),
+            Note.vault_id == note.vault_id,
+            Note.id != note.id
+        ).order_by(Note.id).all()
+
+        by_title = {}
+        for target_id, title in rows:
+            by_title.setdefault(title, target_id)
+        target_ids = set(by_title.values())
+
+    existing = set(db.execute(
+        select(note_links.c.target_id).where(note_links.c.source_id == note.id)
+    ).scalars())
+
+    to_remove = existing - target_ids
+    to_add = target_ids - existing
+    if to_remove:
+        db.execute(note_links.delete().where(
+            note_links.c.source_id == note.id,
+            note_links.c.target_id.in_(to_remove)
+        ))
+    if to_add:
+        db.execute(note_links.insert(), [{"source_id": note.id, "target_id": t} for t in to_add])
+
+
+def note_to_response(note: Note) -> NoteResponse:
+    return NoteResponse.model_construct(
+        id=note.id,
+        title=note.title,
+        content=note.content,
+        folder_id=note.folder_id,
+        vault_id=note.vault_id,
+        created_at=note.created_at,
+        updated_at=note.updated_at,
+        links_to=[NoteLinkInfo.model_construct(id=n.id, title=n.title) for n in note.links_to],
+        linked_from=[NoteLinkInfo.model_construct(id=n.id, title=n.title) for n in note.linked_from]
+    )
+
+
+def vault_cache_key(kind: str, vault_id: Optional[int], suffix: str = "") -> Optional[str]:
+    generation = response_cache.get_generation(f"v1:gen:vault:{vault_id}")
+    if generation is None:
+        return None
+    return f"v1:{kind}:vault:{vault_id}:gen:{generation}{suffix}"
+
 
-    for title in link_titles:
-        target = db.query(Note).filter(Note.title == title).first()
-        if target and target.id != note.id:
-            note.links_to.append(target)
+def invalidate_vault_cache(vault_id: Optional[int]):
+    for cached_vault_id in {vault_id, None}:
+        response_cache.bump_generation(f"v1:gen:vault:{cached_vault_id}")
+
+
+def cached_json_response(payload: bytes) -> Response:
+    return Response(content=payload, media_type="application/json")
 
 @app.get("/folders", response_model=List[FolderResponse], tags=["Folders"])
 def get_folders(
     vault_id: Optional[int] = Query(None, description="Filter by vault"),
     db: Session = Depends(get_db)
 ):
-    query = db.query(Folder)
+    query = select(Folder.id, Folder.name, Folder.parent_id, Folder.vault_id, Folder.created_at)
     if vault_id is not None:
-        query = query.filter(Folder.vault_id == vault_id)
-    return query.all()
+        query = query.where(Folder.vault_id == vault_id)
+    return [FolderResponse.model_construct(**row._mapping) for row in db.execute(query)]
 
 
 @app.post("/folders", response_model=FolderResponse, status_code=201, tags=["Folders"])
@@ -102,6 +210,7 @@ def delete_folder(folder_id: int, db: Session = Depends(get_db)):
     db.query(Note).filter(Note.folder_id == folder_id).update({"folder_id": None})
     db.delete(folder)
     db.commit()
+    invalidate_vault_cache(folder.vault_id)
     return {"message": "Folder deleted"}
 
 @app.get("/notes", response_model=List[NoteResponse], tags=["Notes"])
@@ -110,12 +219,25 @@ def get_notes(
     vault_id: Optional[int] = Query(None, description="Filter by vault"),
     db: Session = Depends(get_db)
 ):
-    query = db.query(Note)
+    cache_key = vault_cache_key("notes", vault_id, f":folder:{folder_id}")
+    cached = response_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        return cached_json_response(cached)
+
+    query = db.query(Note).options(
+        selectinload(Note.links_to).load_only(Note.id, Note.title),
+        selectinload(Note.linked_from).load_only(Note.id, Note.title)
+    )
     if folder_id is not None:
         query = query.filter(Note.folder_id == folder_id)
     if vault_id is not None:
         query = query.filter(Note.vault_id == vault_id)
-    return query.order_by(Note.updated_at.desc()).all()
+    notes = query.order_by(Note.updated_at.desc(), Note.id.desc()).all()
+
+    payload = orjson.dumps([note_to_response(n).model_dump(mode="json") for n in notes])
+    if cache_key:
+        response_cache.set(cache_key, payload)
+    return cached_json_response(payload)
 
 
 @app.get("/notes/{note_id}", response_model=NoteResponse, tags=["Notes"])
@@ -123,7 +245,7 @@ def get_note(note_id: int, db: Session = Depends(get_db)):
     note = db.query(Note).filter(Note.id == note_id).first()
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
-    return note
+    return note_to_response(note)
 
 
 @app.post("/notes", response_model=NoteResponse, status_code=201, tags=["Notes"])
@@ -135,11 +257,12 @@ def create_note(note_data: NoteCreate, db: Session = Depends(get_db)):
         vault_id=note_data.vault_id
     )
     db.add(note)
-    db.commit()
+    db.flush()
 
     update_note_links(db, note)
     db.commit()
     db.refresh(note)
+    invalidate_vault_cache(note.vault_id)
 
     return note
 
@@ -166,10 +289,11 @@ def update_note(note_id: int, note_data: NoteUpdate, db: Session = Depends(get_d
     if note_data.folder_id is not None:
         note.folder_id = note_data.folder_id if note_data.folder_id > 0 else None
 
-    note.updated_at = datetime.utcnow()
+    note.updated_at = utc_now_sql()
     update_note_links(db, note)
     db.commit()
     db.refresh(note)
+    invalidate_vault_cache(note.vault_id)
 
     return note
 
@@ -182,6 +306,7 @@ def delete_note(note_id: int, db: Session = Depends(get_db)):
 
     db.delete(note)
     db.commit()
+    invalidate_vault_cache(note.vault_id)
     return {"message": "Note deleted"}
 
 
@@ -191,7 +316,7 @@ def get_note_versions(note_id: int, db: Session = Depends(get_db)):
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
 
-    versions = db.query(NoteVersion).filter(NoteVersion.note_id == note_id).order_by(NoteVersion.created_at.desc()).all()
+    versions = db.query(NoteVersion).filter(NoteVersion.note_id == note_id).order_by(NoteVersion.created_at.desc(), NoteVersion.id.desc()).all()
     return versions
 
 
@@ -217,11 +342,12 @@ def restore_note_version(note_id: int, version_id: int, db: Session = Depends(ge
 
     note.title = version.title
     note.content = version.content
-    note.updated_at = datetime.utcnow()
+    note.updated_at = utc_now_sql()
 
     update_note_links(db, note)
     db.commit()
     db.refresh(note)
+    invalidate_vault_cache(note.vault_id)
 
     return note
 
@@ -231,19 +357,29 @@ def get_graph(
     vault_id: Optional[int] = Query(None, description="Filter by vault"),
     db: Session = Depends(get_db)
 ):
-    query = db.query(Note)
+    cache_key = vault_cache_key("graph", vault_id)
+    cached = response_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        return cached_json_response(cached)
+
+    node_query = db.query(Note.id, Note.title, Note.folder_id)
+    edge_query = db.query(note_links.c.source_id, note_links.c.target_id).join(
+        Note, Note.id == note_links.c.source_id
+    )
     if vault_id is not None:
-        query = query.filter(Note.vault_id == vault_id)
-    notes = query.all()
+        node_query = node_query.filter(Note.vault_id == vault_id)
+        edge_query = edge_query.filter(Note.vault_id == vault_id)
 
-    nodes = [GraphNode(id=n.id, title=n.title, folder_id=n.folder_id) for n in notes]
+    nodes = [
+        GraphNode.model_construct(id=note_id, title=title, folder_id=folder_id)
+        for note_id, title, folder_id in node_query.all()
+    ]
+    edges = [GraphEdge.model_construct(source=source, target=target) for source, target in edge_query.all()]
 
-    edges = []
-    for note in notes:
-        for linked in note.links_to:
-            edges.append(GraphEdge(source=note.id, target=linked.id))
-
-    return GraphData(nodes=nodes, edges=edges)
+    payload = orjson.dumps(GraphData(nodes=nodes, edges=edges).model_dump(mode="json"))
+    if cache_key:
+        response_cache.set(cache_key, payload)
+    return cached_json_response(payload)
 
 
 @app.get("/health", tags=["System"])
@@ -251,8 +387,7 @@ def health_check():
     return {"status": "healthy"}
 
 
-@app.post("/auth/register", response_model=TokenResponse, status_code=201, tags=["Auth"])
-def register(user_data: UserCreate, db: Session = Depends(get_db)):
+def check_registration_available(db: Session, user_data: UserCreate):
     if get_user_by_email(db, user_data.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -265,10 +400,14 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
             detail="Username already taken"
         )
 
+    db.rollback()
+
+
+def create_registered_user(db: Session, user_data: UserCreate, hashed_password: str) -> TokenResponse:
     user = User(
         email=user_data.email,
         username=user_data.username,
-        hashed_password=get_password_hash(user_data.password)
+        hashed_password=hashed_password
     )
     db.add(user)
     db.commit()
@@ -290,18 +429,15 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
     )
 
 
-@app.post("/auth/login", response_model=TokenResponse, tags=["Auth"])
-def login(credentials: UserLogin, db: Session = Depends(get_db)):
-    user = authenticate_user(db, credentials.email, credentials.password)
+@app.post("/auth/register", response_model=TokenResponse, status_code=201, tags=["Auth"])
+async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+    await run_in_threadpool(check_registration_available, db, user_data)
+    hashed_password = await run_bcrypt(get_password_hash, user_data.password)
+    return await run_in_threadpool(create_registered_user, db, user_data, hashed_password)
 
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect email or password",
-            headers={"WWW-Authenticate": "Bearer"}
-        )
 
-    user.last_login = datetime.utcnow()
+def record_login(db: Session, user: User) -> TokenResponse:
+    user.last_login = utc_now_sql()
     db.commit()
 
     access_token = create_access_token(data={"sub": str(user.id)})
@@ -312,6 +448,20 @@ def login(credentials: UserLogin, db: Session = Depends(get_db)):
     )
 
 
+@app.post("/auth/login", response_model=TokenResponse, tags=["Auth"])
+async def login(credentials: UserLogin, db: Session = Depends(get_db)):
+    user = await authenticate_user(db, credentials.email, credentials.password)
+
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+    return await run_in_threadpool(record_login, db, user)
+
+
 @app.post("/auth/guest", response_model=TokenResponse, tags=["Auth"])
 def guest_login(db: Session = Depends(get_db)):
     guest = create_guest_user(db)
@@ -396,5 +546,6 @@ async def delete_vault(
 
     db.delete(vault)
     db.commit()
+    invalidate_vault_cache(vault_id)
 
     return {"message": "Vault deleted"}
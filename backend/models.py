@@ -1,12 +1,21 @@
-from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Table, Boolean
+import zstandard
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Table, Boolean, Index, LargeBinary, func
 from sqlalchemy.orm import relationship
 
 from database import Base
 
+VERSION_COMPRESSION_LEVEL = 3
+
+
+def utc_now_sql():
+    return func.strftime('%Y-%m-%d %H:%M:%f', 'now')
+
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_guest_lastlogin", "is_guest", "last_login"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     email = Column(String(255), unique=True, index=True, nullable=False)
@@ -14,7 +23,7 @@ class User(Base):
     hashed_password = Column(String(255), nullable=False)
     is_active = Column(Boolean, default=True)
     is_guest = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=utc_now_sql(), nullable=False)
     last_login = Column(DateTime, nullable=True)
 
     vaults = relationship("Vault", back_populates="owner", cascade="all, delete-orphan")
@@ -25,9 +34,9 @@ class Vault(Base):
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     name = Column(String(255), nullable=False)
-    owner_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    owner_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
     is_default = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=utc_now_sql(), nullable=False)
 
     owner = relationship("User", back_populates="vaults")
     folders = relationship("Folder", back_populates="vault", cascade="all, delete-orphan")
@@ -49,7 +58,7 @@ class Folder(Base):
     name = Column(String(255), nullable=False)
     parent_id = Column(Integer, ForeignKey('folders.id'), nullable=True)
     vault_id = Column(Integer, ForeignKey('vaults.id'), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=utc_now_sql(), nullable=False)
 
     vault = relationship("Vault", back_populates="folders")
     notes = relationship("Note", back_populates="folder")
@@ -58,18 +67,21 @@ class Folder(Base):
 
 class Note(Base):
     __tablename__ = "notes"
+    __table_args__ = (
+        Index("ix_notes_vault_folder", "vault_id", "folder_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     title = Column(String(255), nullable=False, index=True)
     content = Column(Text, nullable=False, default="")
     folder_id = Column(Integer, ForeignKey('folders.id'), nullable=True)
     vault_id = Column(Integer, ForeignKey('vaults.id'), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=utc_now_sql(), nullable=False)
+    updated_at = Column(DateTime, default=utc_now_sql(), onupdate=utc_now_sql(), nullable=False)
 
     vault = relationship("Vault", back_populates="notes")
     folder = relationship("Folder", back_populates="notes")
-    versions = relationship("NoteVersion", back_populates="note", cascade="all, delete-orphan", order_by="desc(NoteVersion.created_at)")
+    versions = relationship("NoteVersion", back_populates="note", cascade="all, delete-orphan", order_by="[desc(NoteVersion.created_at), desc(NoteVersion.id)]")
 
     links_to = relationship(
         "Note",
@@ -86,11 +98,28 @@ class Note(Base):
 
 class NoteVersion(Base):
     __tablename__ = "note_versions"
+    __table_args__ = (
+        Index("ix_versions_note_created", "note_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     note_id = Column(Integer, ForeignKey('notes.id'), nullable=False)
     title = Column(String(255), nullable=False)
-    content = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    raw_content = Column("content", Text, nullable=False, default="")
+    content_zstd = Column(LargeBinary, nullable=True)
+    is_compressed = Column(Boolean, default=False, nullable=False)
+    created_at = Column(DateTime, default=utc_now_sql(), nullable=False)
 
     note = relationship("Note", back_populates="versions")
+
+    @property
+    def content(self):
+        if self.is_compressed:
+            return zstandard.decompress(self.content_zstd).decode('utf-8')
+        return self.raw_content
+
+    @content.setter
+    def content(self, value):
+        self.content_zstd = zstandard.compress(value.encode('utf-8'), VERSION_COMPRESSION_LEVEL)
+        self.raw_content = ""
+        self.is_compressed = True